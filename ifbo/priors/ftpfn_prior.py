@@ -1,14 +1,15 @@
 from collections.abc import Callable
+from dataclasses import dataclass
 import math
 import os
 from typing import Any
 import warnings
 
 import numpy as np
-from scipy.stats import beta
-from scipy.stats import expon
-from scipy.stats import gamma
-from scipy.stats import norm
+from scipy.linalg import cholesky
+from scipy.special import betaincinv
+from scipy.special import gammaincinv
+from scipy.special import ndtri
 import torch
 
 from ifbo import encoders
@@ -17,28 +18,58 @@ from ifbo.priors.prior import Batch
 from ifbo.utils import default_device
 
 
+# sorted (float32) BNN outputs, approximating their CDF, memory-mapped and paged in on use
 OUTPUT_SORTED = np.load(
-    os.path.join(os.path.dirname(os.path.abspath(__file__)), "output_sorted.npy")
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "output_sorted.npy"), mmap_mode="r"
 )
+OUTPUT_SORTED_INV_LEN = 1.0 / len(OUTPUT_SORTED)
 
 
-def progress_noise(X: np.ndarray, sigma: float, L: float) -> np.ndarray:
-    EPS = 10**-9
-    N = len(X)
-
-    Z = np.random.normal(0, sigma, size=(N,))
-
-    SIGMA = np.exp(-(np.subtract.outer(X, X) ** 2) / L)
-
-    SIGMA += EPS * np.eye(N)  # to guarantee SPD
+def bnn_quantiles(bnn_output: np.ndarray) -> np.ndarray:
+    # quantiles of the bnn outputs under the CDF approximated by OUTPUT_SORTED
+    # the outputs are looked up in sorted order, so that consecutive searches stay in cache
+    # keys share the table's float32 dtype, so searchsorted does not upcast the table per call
+    keys = np.asarray(bnn_output, dtype=OUTPUT_SORTED.dtype)
+    order = np.argsort(keys, axis=None)
+    indices = np.empty(order.shape, dtype=np.int64)
+    indices[order] = np.searchsorted(OUTPUT_SORTED, keys.ravel()[order], side="left")
+    return indices.reshape(np.shape(bnn_output)) * OUTPUT_SORTED_INV_LEN
 
-    C = np.linalg.cholesky(SIGMA)
 
-    return C @ Z
+def progress_noise(X: np.ndarray, sigmas: np.ndarray, Ls: np.ndarray) -> np.ndarray:
+    # X is either a single grid (N,) shared by all curves, or one grid per curve (B, N)
+    EPS = 10**-9
+    sigmas = np.atleast_1d(np.asarray(sigmas, dtype=np.float64))
+    Ls = np.broadcast_to(np.asarray(Ls, dtype=np.float64), sigmas.shape)
+    X = np.broadcast_to(X, (len(sigmas), np.shape(X)[-1]))
+    B, N = X.shape
+
+    noise = np.empty((B, N))
+    # for tiny sigmas the correlation is negligible, sample white noise without factorization
+    white = sigmas < 1e-4
+    noise[white] = np.random.normal(size=(white.sum(), N)) * sigmas[white, None]
+    # curves sharing the grid and length-scale share a single Cholesky factorization
+    shared_grid = bool((X == X[0]).all())
+    for L in np.unique(Ls[~white]):
+        group = np.flatnonzero((Ls == L) & ~white)
+        grids = [X[0]] if shared_grid else [X[cid] for cid in group]
+        members = [group] if shared_grid else list(group[:, None])
+        for x, cids in zip(grids, members):
+            # build the kernel matrix in a single N x N buffer, which is factorized in place
+            SIGMA = np.subtract.outer(x, x)
+            np.square(SIGMA, out=SIGMA)
+            SIGMA /= -L
+            np.exp(SIGMA, out=SIGMA)
+            SIGMA.flat[:: N + 1] += EPS  # to guarantee SPD
+            C = cholesky(SIGMA, lower=True, overwrite_a=True, check_finite=False)
+            Z = np.random.normal(size=(N, len(cids))) * sigmas[cids]
+            noise[cids] = (C @ Z).T
+
+    return noise
 
 
 def add_noise_and_break(
-    x: np.ndarray, x_noise: None, Xsat: np.ndarray, Rpsat: np.ndarray
+    x: np.ndarray, x_noise: np.ndarray | None, Xsat: np.ndarray, Rpsat: np.ndarray
 ) -> np.ndarray:
     x = np.where(
         x < Xsat, x, Rpsat * (x - Xsat) + Xsat
@@ -51,69 +82,144 @@ def add_noise_and_break(
     # return noisy_x
 
 
+# the basis curves are evaluated in place on t = rate * x (see basis_constants)
+def pow4_curve(
+    t: np.ndarray,
+    Yinf: float | np.ndarray,
+    scale: np.ndarray,
+    PREC: np.ndarray,
+    alpha: np.ndarray,
+) -> np.ndarray:
+    t += 1
+    np.power(t, -alpha, out=t)
+    t *= scale
+    return np.subtract(Yinf, t, out=t)
+
+
+def exp_curve(
+    t: np.ndarray,
+    Yinf: float | np.ndarray,
+    scale: np.ndarray,
+    PREC: np.ndarray,
+    alpha: np.ndarray,
+) -> np.ndarray:
+    np.power(t, alpha, out=t)
+    np.negative(t, out=t)
+    np.power(PREC, t, out=t)
+    t *= scale
+    return np.subtract(Yinf, t, out=t)
+
+
+def log_curve(
+    t: np.ndarray,
+    Yinf: float | np.ndarray,
+    scale: np.ndarray,
+    PREC: np.ndarray,
+    alpha: np.ndarray,
+) -> np.ndarray:
+    t += alpha
+    np.log(t, out=t)
+    np.divide(scale, t, out=t)
+    return np.subtract(Yinf, t, out=t)
+
+
+def hill_curve(
+    t: np.ndarray,
+    Yinf: float | np.ndarray,
+    scale: np.ndarray,
+    PREC: np.ndarray,
+    alpha: np.ndarray,
+) -> np.ndarray:
+    np.power(t, alpha, out=t)
+    t *= PREC - 1
+    t += 1
+    np.divide(scale, t, out=t)
+    return np.subtract(Yinf, t, out=t)
+
+
+BASIS_CURVES = (pow4_curve, exp_curve, log_curve, hill_curve)
+
+
+def basis_constants(
+    Y0: float, Yinf: float | np.ndarray, PREC: np.ndarray, Xsat: np.ndarray, alpha: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # the x-independent constants of each basis curve (trailing basis axis): the rate scaling x,
+    # the scale of the saturating term, and the gradient at 0 continued by the exponential tail
+    EPS = 10**-9
+    PREC, Xsat, alpha = map(np.asarray, (PREC, Xsat, alpha))
+    Yinf = np.asarray(Yinf)
+    rate = 1 / Xsat
+    rate[..., 0] *= PREC[..., 0] ** (1 / alpha[..., 0]) - 1
+    rate[..., 2] *= alpha[..., 2] ** PREC[..., 2] - alpha[..., 2]
+    scale = np.broadcast_to(Yinf[..., None] - Y0, rate.shape).copy()
+    scale[..., 2] *= np.log(alpha[..., 2])
+    tail_grad = np.empty(rate.shape)
+    for i, basis_curve in enumerate(BASIS_CURVES):
+        t_eps = np.multiply.outer([EPS, 2 * EPS], rate[..., i])
+        y_eps = basis_curve(t_eps, Yinf, scale[..., i], PREC[..., i], alpha[..., i])
+        tail_grad[..., i] = (y_eps[1] - y_eps[0]) / EPS
+    return rate, scale, tail_grad
+
+
 def comb(
     x: np.ndarray,
     Y0: float = 0.2,
-    Yinf: float = 0.8,
+    Yinf: float | np.ndarray = 0.8,
     sigma: float | None = 0.01,
     L: float | None = 0.0001,
-    PREC: list[int] = [100] * 4,
-    Xsat: list[float] = [1.0] * 4,
-    alpha: list[float] = [np.exp(1), np.exp(-1), 1 + np.exp(-4), np.exp(0)],
-    Rpsat: list[float] = [1.0] * 4,
-    w: list[float] = [1 / 4] * 4,
-) -> float:
-    # x_noise = progress_noise(x,sigma,L)
-    x_noise = None
-    EPS = 10**-9
-    x_eps = np.array([EPS, 2 * EPS])
-
-    # POW4 with exponential tail
-    x_pow = add_noise_and_break(x, x_noise, Xsat[0], Rpsat[0])
-    pow_eps = (
-        Yinf - (Yinf - Y0) * (((PREC[0]) ** (1 / alpha[0]) - 1) / Xsat[0] * x_eps + 1) ** -alpha[0]
-    )
-    pow_grad = (pow_eps[1] - pow_eps[0]) / EPS
-    pow_y = np.where(
-        x_pow > 0,
-        Yinf
-        - (Yinf - Y0) * (((PREC[0]) ** (1 / alpha[0]) - 1) / Xsat[0] * x_pow + 1) ** -alpha[0],
-        Y0 * np.exp(x_pow * (pow_grad + EPS) / Y0),
-    )
-
-    x_exp = add_noise_and_break(x, x_noise, Xsat[1], Rpsat[1])
-    exp_eps = Yinf - (Yinf - Y0) * PREC[1] ** (-((x_eps / Xsat[1]) ** alpha[1]))
-    exp_grad = (exp_eps[1] - exp_eps[0]) / EPS
-    exp_y = np.where(
-        x_exp > 0,
-        Yinf - (Yinf - Y0) * PREC[1] ** (-((x_exp / Xsat[1]) ** alpha[1])),
-        Y0 * np.exp(x_exp * (exp_grad + EPS) / Y0),
-    )
-
-    x_log = add_noise_and_break(x, x_noise, Xsat[2], Rpsat[2])
-    log_eps = Yinf - (Yinf - Y0) * np.log(alpha[2]) / (
-        np.log((alpha[2] ** PREC[2] - alpha[2]) * x_eps / Xsat[2] + alpha[2])
-    )
-    log_grad = (log_eps[1] - log_eps[0]) / EPS
-    log_y = np.where(
-        x_log > 0,
-        Yinf
-        - (Yinf - Y0)
-        * np.log(alpha[2])
-        / (np.log((alpha[2] ** PREC[2] - alpha[2]) * x_log / Xsat[2] + alpha[2])),
-        Y0 * np.exp(x_log * (log_grad + EPS) / Y0),
-    )
-
-    x_hill = add_noise_and_break(x, x_noise, Xsat[3], Rpsat[3])
-    hill_eps = Yinf - (Yinf - Y0) / ((x_eps / Xsat[3]) ** alpha[3] * (PREC[3] - 1) + 1)
-    hill_grad = (hill_eps[1] - hill_eps[0]) / EPS
-    hill_y = np.where(
-        x_hill > 0,
-        Yinf - (Yinf - Y0) / ((x_hill / Xsat[3]) ** alpha[3] * (PREC[3] - 1) + 1),
-        Y0 * np.exp(x_hill * (hill_grad + EPS) / Y0),
+    PREC: np.ndarray | list[float] = [100] * 4,
+    Xsat: np.ndarray | list[float] = [1.0] * 4,
+    alpha: np.ndarray | list[float] = [np.exp(1), np.exp(-1), 1 + np.exp(-4), np.exp(0)],
+    Rpsat: np.ndarray | list[float] = [1.0] * 4,
+    w: np.ndarray | list[float] = [1 / 4] * 4,
+    constants: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None,
+    *,
+    x_noise: np.ndarray | None = None,
+) -> np.ndarray:
+    # x_noise (e.g., progress_noise(x, sigma, L)[0]) is precomputed once and shared by all bases,
+    # it is not applied yet, as the x-noise path of add_noise_and_break is still disabled
+    # the curve parameters are either shared by all x, or given per x (with a trailing basis axis)
+    # the basis_constants are computed here, unless precomputed (once per curve) by the caller
+    PREC_arr, Xsat_arr, alpha_arr, Rpsat_arr, w_arr = map(
+        np.asarray, (PREC, Xsat, alpha, Rpsat, w)
     )
+    rate, scale, tail_grad = constants or basis_constants(Y0, Yinf, PREC_arr, Xsat_arr, alpha_arr)
+    EPS = 10**-9
 
-    return w[0] * pow_y + w[1] * exp_y + w[2] * log_y + w[3] * hill_y
+    # weighted sum of the POW4, EXP, LOG and HILL basis curves, each with an exponential tail,
+    # accumulated in place into a single output buffer
+    y = np.zeros(np.shape(x))
+    for i, basis_curve in enumerate(BASIS_CURVES):
+        x_i = add_noise_and_break(x, x_noise, Xsat_arr[..., i], Rpsat_arr[..., i])
+        # the basis curves work in place, so t must be an array (0-d for a scalar x)
+        t = np.asarray(rate[..., i] * x_i)
+        y_i = np.where(
+            x_i > 0,
+            basis_curve(t, Yinf, scale[..., i], PREC_arr[..., i], alpha_arr[..., i]),
+            Y0 * np.exp(x_i * (tail_grad[..., i] + EPS) / Y0),
+        )
+        y_i *= w_arr[..., i]
+        y += y_i
+
+    return y
+
+
+@dataclass
+class CurveParams:
+    # curve parameters of a batch of configs, stored per parameter (struct of arrays)
+    # with shape (n_configs,), or (n_configs, 4) for the parameters of each basis curve
+    Y0: float
+    Yinf: np.ndarray
+    sigma: np.ndarray
+    w: np.ndarray
+    alpha: np.ndarray
+    Xsat: np.ndarray
+    PREC: np.ndarray
+    Rpsat: np.ndarray
+    # x-independent constants of the basis curves, see basis_constants
+    rate: np.ndarray
+    scale: np.ndarray
+    tail_grad: np.ndarray
 
 
 class MLP(torch.nn.Module):
@@ -150,14 +256,16 @@ class MLP(torch.nn.Module):
     ) -> None:
         init_std = init_std if init_std is not None else self.init_std
         sparseness = sparseness if sparseness is not None else self.sparseness
-        for linear in self.linears:
-            linear.reset_parameters()
 
         with torch.no_grad():
             if init_std is not None:
                 for linear in self.linears:
                     linear.weight.normal_(0, init_std)
                     linear.bias.normal_(0, init_std)
+            else:
+                # only fall back to the default init, if it is not overwritten anyway
+                for linear in self.linears:
+                    linear.reset_parameters()
 
             if sparseness > 0.0:
                 for linear in self.linears[1:-1]:
@@ -206,10 +314,9 @@ class DatasetPrior:
         # reinit the parameters of the BNN
         self.model = self._get_model()
         # initial performance (after init) & max performance
-        u1 = np.random.uniform()
-        u2 = np.random.uniform()
+        u1, u2, u3 = np.random.uniform(size=3)
         self.y0 = min(u1, u2)
-        self.ymax = max(u1, u2) if np.random.uniform() < 0.25 else 1.0
+        self.ymax = max(u1, u2) if u3 < 0.25 else 1.0
         # TODO: this is not standard BOPFN BNN, but consider adding this
         # the input weights (parameter importance & magnitude of aleatoric uncertainty on the curve)
         # param_importance = np.random.dirichlet([1]*(self.num_inputs-1) + [0.1]) # relative parameter importance
@@ -219,16 +326,12 @@ class DatasetPrior:
         # self.output_sensitivity = np.random.uniform(size=(self.num_outputs,))
         # self.output_offset = np.random.uniform((self.output_sensitivity-1)/2,(1-self.output_sensitivity)/2)
 
-    def curves_for_configs(
-        self, configs: np.ndarray, noise: bool = True
-    ) -> Callable[[np.ndarray, int], np.ndarray]:
+    def params_for_configs(self, configs: np.ndarray, noise: bool = True) -> CurveParams:
         # more efficient batch-wise
         ncurves = 4
         bnn_outputs = self.output_for_config(configs, noise=noise)
 
-        indices = np.searchsorted(OUTPUT_SORTED, bnn_outputs, side="left")
-
-        rng4config = MyRNG(indices)
+        rng4config = MyRNG(bnn_quantiles(bnn_outputs))
 
         Y0 = self.y0
 
@@ -237,7 +340,7 @@ class DatasetPrior:
         assert isinstance(Yinf, np.ndarray)
 
         # sample weights for basis curves (dirichlet)
-        w = np.stack([rng4config.gamma(a=1) for i in range(ncurves)]).T  # 1, 2, 3, 4
+        w = np.stack([rng4config.gamma(a=1) for i in range(ncurves)], axis=1)  # 1, 2, 3, 4
         w = w / w.sum(axis=1, keepdims=1)
 
         # sample shape/skew parameter for each basis curve
@@ -247,53 +350,79 @@ class DatasetPrior:
                 np.exp(rng4config.normal(0, 1)),  # 6
                 1.0 + np.exp(rng4config.normal(-4, 1)),  # 7
                 np.exp(rng4config.normal(0.5, 0.5)),
-            ]
-        ).T  # 8
+            ],
+            axis=1,
+        )  # 8
 
         # sample saturation x for each basis curve
         Xsat_max = 10 ** rng4config.normal(0, 1)  # max saturation # 9
         assert isinstance(Xsat_max, np.ndarray)
 
         Xsat_rel = np.stack(
-            [rng4config.gamma(a=1) for i in range(ncurves)]
-        ).T  # relative saturation points # 10, 11, 12, 13
+            [rng4config.gamma(a=1) for i in range(ncurves)], axis=1
+        )  # relative saturation points # 10, 11, 12, 13
 
-        Xsat = ((Xsat_max.T * Xsat_rel.T) / np.max(Xsat_rel, axis=1)).T
+        Xsat = Xsat_max[:, None] * Xsat_rel / np.max(Xsat_rel, axis=1, keepdims=True)
 
         # sample relative saturation y (PREC) for each basis curve
         PREC = np.stack(
-            [1.0 / 10 ** rng4config.uniform(-3, 0) for i in range(ncurves)]
-        ).T  # 14, 15, 16, 17
+            [1.0 / 10 ** rng4config.uniform(-3, 0) for i in range(ncurves)], axis=1
+        )  # 14, 15, 16, 17
 
         # post saturation convergence/divergence rate for each basis curve
         Rpsat = np.stack(
-            [1.0 - rng4config.exponential(scale=1) for i in range(ncurves)]
-        ).T  # 18, 19, 20, 21
+            [1.0 - rng4config.exponential(scale=1) for i in range(ncurves)], axis=1
+        )  # 18, 19, 20, 21
 
         # sample noise parameters
         sigma = np.exp(rng4config.normal(loc=-5, scale=1))
+        assert isinstance(sigma, np.ndarray)
         # sigma_x = np.exp(rng4config.normal(-4,0.5)) # STD of the xGP 22
         # print("warning")
         # sigma_y_scaler = np.exp(rng4config.uniform(-5,0.0)) # STD of the yGP 23
         # L = 10**rng4config.normal(-5,1) # Length-scale of the xyGP 24
 
-        def foo(x_: np.ndarray, cid: int = 0) -> np.ndarray:
+        # precompute the x-independent constants of the basis curves once per curve
+        rate, scale, tail_grad = basis_constants(Y0, Yinf, PREC, Xsat, alpha)
+
+        return CurveParams(
+            Y0=Y0,
+            Yinf=Yinf,
+            sigma=sigma,
+            w=w,
+            alpha=alpha,
+            Xsat=Xsat,
+            PREC=PREC,
+            Rpsat=Rpsat,
+            rate=rate,
+            scale=scale,
+            tail_grad=tail_grad,
+        )
+
+    def curves_for_configs(
+        self, configs: np.ndarray, noise: bool = True
+    ) -> Callable[[np.ndarray, int | np.ndarray], np.ndarray]:
+        params = self.params_for_configs(configs, noise=noise)
+
+        def foo(x_: np.ndarray, cid: int | np.ndarray = 0) -> np.ndarray:
+            # cid is either a single curve id, or the curve id of every x (evaluated at once)
             warnings.filterwarnings("ignore")
             y_ = comb(
                 x_,
-                Y0=Y0,
-                Yinf=Yinf[cid],
+                Y0=params.Y0,
+                Yinf=params.Yinf[cid],
                 sigma=None,
                 L=None,
-                Xsat=Xsat[cid],
-                alpha=alpha[cid],
-                Rpsat=Rpsat[cid],
-                w=w[cid],
-                PREC=PREC[cid],
+                Xsat=params.Xsat[cid],
+                alpha=params.alpha[cid],
+                Rpsat=params.Rpsat[cid],
+                w=params.w[cid],
+                PREC=params.PREC[cid],
+                constants=(params.rate[cid], params.scale[cid], params.tail_grad[cid]),
             )
             # y_ = comb(x_, Y0=Y0, Yinf=Yinf[cid], sigma=sigma_x[cid], L=L[cid], Xsat=Xsat[cid], alpha=alpha[cid], Rpsat=Rpsat[cid], w=w[cid], PREC=PREC[cid])
-            y_noise = np.random.normal(size=x_.shape, scale=sigma[cid])
-            # y_noise = progress_noise(x_,1,L)
+            y_noise = np.random.normal(size=x_.shape, scale=params.sigma[cid])
+            # y_noise = progress_noise(x_, 1, L[cid])[0]
             # y_noise *= np.minimum(y_,1.0-y_)/4*sigma_y_scaler[cid]
             return np.clip(y_ + y_noise, 0.0, 1.0)
 
@@ -301,77 +430,78 @@ class DatasetPrior:
 
     def output_for_config(self, config: np.ndarray, noise: bool = True) -> np.ndarray:
         # add aleatoric noise & bias
-        output = self._output_for(torch.from_numpy(config))
+        # cast once to the model's float32, so normalization does not run in float64
+        output = self._output_for(torch.from_numpy(config).float())
         return output.numpy()
 
     def uniform(self, bnn_output: np.ndarray, a: float = 0.0, b: float = 1.0) -> np.ndarray:
-        indices = np.searchsorted(OUTPUT_SORTED, bnn_output, side="left")
-        return (b - a) * indices / len(OUTPUT_SORTED) + a
+        return (b - a) * bnn_quantiles(bnn_output) + a
 
     def normal(self, bnn_output: np.ndarray, loc: float = 0, scale: float = 1) -> np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(bnn_output, a=eps, b=1 - eps)
-        return norm.ppf(u, loc=loc, scale=scale)
+        return ndtri(u) * scale + loc
 
     def beta(
         self, bnn_output: np.ndarray, a: float = 1, b: float = 1, loc: float = 0, scale: float = 1
     ) -> np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(bnn_output, a=eps, b=1 - eps)
-        return beta.ppf(u, a=a, b=b, loc=loc, scale=scale)
+        return betaincinv(a, b, u) * scale + loc
 
     def gamma(
         self, bnn_output: np.ndarray, a: float = 1, loc: float = 0, scale: float = 1
     ) -> np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(bnn_output, a=eps, b=1 - eps)
-        return gamma.ppf(u, a=a, loc=loc, scale=scale)
+        return gammaincinv(a, u) * scale + loc
 
     def exponential(self, bnn_output: np.ndarray, scale: float = 1) -> np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(bnn_output, a=eps, b=1 - eps)
-        return expon.ppf(u, scale=scale)
+        return -np.log1p(-u) * scale
 
 
 class MyRNG:
-    def __init__(self, indices: np.ndarray) -> None:
-        self.indices = indices.T
+    def __init__(self, u: np.ndarray) -> None:
+        # quantiles of all bnn outputs (see bnn_quantiles), one row per draw
+        self.u = u.T
         self.reset()
 
     def reset(self) -> None:
         self.counter = 0
 
     def uniform(self, a: float = 0.0, b: float = 1.0) -> float | np.ndarray:
-        u = (b - a) * self.indices[self.counter] / len(OUTPUT_SORTED) + a
+        u = (b - a) * self.u[self.counter] + a
         self.counter += 1
         return u
 
     def normal(self, loc: float = 0, scale: float = 1) -> float | np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(a=eps, b=1 - eps)
-        return norm.ppf(u, loc=loc, scale=scale)
+        return ndtri(u) * scale + loc
 
     def beta(
         self, a: float = 1, b: float = 1, loc: float = 0, scale: float = 1
     ) -> float | np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(a=eps, b=1 - eps)
-        return beta.ppf(u, a=a, b=b, loc=loc, scale=scale)
+        return betaincinv(a, b, u) * scale + loc
 
     def gamma(self, a: float = 1, loc: float = 0, scale: float = 1) -> float | np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(a=eps, b=1 - eps)
-        return gamma.ppf(u, a=a, loc=loc, scale=scale)
+        return gammaincinv(a, u) * scale + loc
 
     def exponential(self, scale: float = 1) -> float | np.ndarray:
-        eps = 0.5 / len(OUTPUT_SORTED)  # to avoid infinite samples
+        eps = 0.5 * OUTPUT_SORTED_INV_LEN  # to avoid infinite samples
         u = self.uniform(a=eps, b=1 - eps)
-        return expon.ppf(u, scale=scale)
+        return -np.log1p(-u) * scale
 
 
 def curve_prior(
     dataset: DatasetPrior, config: np.ndarray
-) -> Callable[[np.ndarray, int], np.ndarray]:
+) -> Callable[[np.ndarray, int | np.ndarray], np.ndarray]:
     # calls the more efficient batch-wise method
     return dataset.curves_for_configs(np.array([config]))
 
@@ -398,101 +528,84 @@ def get_batch(
 
     dataset_prior = DatasetPrior(num_params, 23)
 
-    x = []
-    y = []
+    # the bulk draws of the batch use a (faster) PCG64 generator, seeded from the global state,
+    # so that seeding np.random (e.g., per chunk in PriorDataLoader.store_prior) still applies
+    rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
+
+    # the batch is filled in place, column by column, and moved to the device at once
+    x = np.empty((seq_len, batch_size, 2 + num_params), dtype=np.float32)
+    y = np.empty((seq_len, batch_size), dtype=np.float32)
+
+    # draw the per batch element random variables for all batch elements at once
+    # determine the number of fidelity levels (ranging from 1: BB, up to seq_len)
+    all_n_levels = np.round(10 ** rng.uniform(0, 3, size=batch_size)).astype(int)
+    # determine # observations/queries per curve
+    # TODO: also make this a dirichlet thing
+    all_alpha = 10 ** rng.uniform(-4, -1, size=(batch_size, 1))
+    all_weights = rng.gamma(all_alpha, all_alpha, (batch_size, seq_len)) + EPS
+    all_curve_configs = rng.uniform(size=(batch_size, seq_len, num_params))
 
     for i in range(batch_size):
-        epoch = torch.zeros(seq_len)
-        id_curve = torch.zeros(seq_len)
-        curve_val = torch.zeros(seq_len)
-        config = torch.zeros(seq_len, num_params)
-
-        # determine the number of fidelity levels (ranging from 1: BB, up to seq_len)
-        n_levels = int(np.round(10 ** np.random.uniform(0, 3)))
-        # print(f"n_levels: {n_levels}")
-
-        # determine # observations/queries per curve
-        # TODO: also make this a dirichlet thing
-        alpha = 10 ** np.random.uniform(-4, -1)
-        # print(f"alpha: {alpha}")
-        weights = np.random.gamma(alpha, alpha, seq_len) + EPS
-        p = weights / np.sum(weights)
-        ids = np.arange(seq_len)
-        all_levels = np.repeat(ids, n_levels)
-        all_p = np.repeat(p, n_levels) / n_levels
-        ordering = np.random.choice(all_levels, p=all_p, size=seq_len, replace=False)
+        n_levels = all_n_levels[i]
+        p = all_weights[i] / np.sum(all_weights[i])
+        # sample seq_len of the seq_len * n_levels (curve, level) pairs without replacement,
+        # with probability p / n_levels each, using Gumbel top-k: the pairs with the largest
+        # log-probability + Gumbel noise, in decreasing order, are distributed as sequential
+        # sampling without replacement
+        keys = np.repeat(np.log(p), n_levels) + rng.gumbel(size=seq_len * n_levels)
+        top = np.argpartition(-keys, seq_len - 1)[:seq_len]
+        top = top[np.argsort(-keys[top])]
+        ordering = top // n_levels  # curve id of the pairs
 
         # calculate the cutoff/samples for each curve
-        cutoff_per_curve = np.zeros((seq_len,), dtype=int)
-        epochs_per_curve = np.zeros((seq_len,), dtype=int)
-        for i in range(seq_len):  # loop over every pos
-            cid = ordering[i]
-            epochs_per_curve[cid] += 1
-            if i < single_eval_pos:
-                cutoff_per_curve[cid] += 1
+        epochs_per_curve = np.bincount(ordering, minlength=seq_len)
+        cutoff_per_curve = np.bincount(ordering[:single_eval_pos], minlength=seq_len)
 
         # fix dataset specific random variables
         dataset_prior.new_dataset()
 
         # determine config, x, y for every curve
-        curve_configs = np.random.uniform(size=(seq_len, num_params))
+        curve_configs = all_curve_configs[i]
         curves = dataset_prior.curves_for_configs(curve_configs)
-        curve_xs = []
-        curve_ys = []
-        for cid in range(seq_len):  # loop over every curve
-            if epochs_per_curve[cid] > 0:
-                # determine x (observations + query)
-                x_ = np.zeros((epochs_per_curve[cid],))
-                if cutoff_per_curve[cid] > 0:  # observations (if any)
-                    x_[: cutoff_per_curve[cid]] = (
-                        np.arange(1, cutoff_per_curve[cid] + 1) / n_levels
-                    )
-                if cutoff_per_curve[cid] < epochs_per_curve[cid]:  # queries (if any)
-                    x_[cutoff_per_curve[cid] :] = (
-                        np.random.choice(
-                            np.arange(cutoff_per_curve[cid] + 1, n_levels + 1),
-                            size=epochs_per_curve[cid] - cutoff_per_curve[cid],
-                            replace=False,
-                        )
-                        / n_levels
-                    )
-                curve_xs.append(x_)
-                # determine y's
-                y_ = curves(x_, cid)
-                curve_ys.append(y_)
-            else:
-                curve_xs.append(None)
-                curve_ys.append(None)
+        # determine x (observations + queries) of every curve, concatenated curve by curve
+        levels = np.arange(1, n_levels + 1) / n_levels
+        curve_starts = np.cumsum(epochs_per_curve) - epochs_per_curve
+        rank_in_curve = np.arange(seq_len) - np.repeat(curve_starts, epochs_per_curve)
+        x_flat = levels[rank_in_curve]  # observations are the first cutoff levels
+        for cid in np.flatnonzero(cutoff_per_curve < epochs_per_curve):  # queries (if any)
+            start, cutoff = curve_starts[cid] + cutoff_per_curve[cid], cutoff_per_curve[cid]
+            n_queries = epochs_per_curve[cid] - cutoff
+            x_flat[start : start + n_queries] = levels[
+                cutoff + rng.choice(n_levels - cutoff, size=n_queries, replace=False)
+            ]
+        # determine y's, evaluating all curves at once
+        y_flat = curves(x_flat, np.repeat(np.arange(seq_len), epochs_per_curve))
 
         # construct the batch data element
-        curve_counters = torch.zeros(seq_len).type(torch.int64)
-        for i in range(seq_len):
-            cid = ordering[i]
-            if i < single_eval_pos or curve_counters[cid] > 0:
-                id_curve[i] = cid + 1  # reserve ID 0 for queries
-            else:
-                id_curve[i] = 0  # queries for unseen curves always have ID 0
-            epoch[i] = curve_xs[cid][curve_counters[cid]]
-            config[i] = torch.from_numpy(curve_configs[cid])
-            curve_val[i] = curve_ys[cid][curve_counters[cid]]
-            curve_counters[cid] += 1
+        # the k-th occurrence of a curve in the ordering gets its k-th x and y, i.e., the
+        # positions stably sorted by curve follow the layout of the concatenated x's
+        flat_idx = np.empty((seq_len,), dtype=int)
+        flat_idx[np.argsort(ordering, kind="stable")] = np.arange(seq_len)
+        curve_counters = rank_in_curve[flat_idx]
+        # reserve ID 0 for queries, queries for unseen curves always have ID 0
+        seen = (np.arange(seq_len) < single_eval_pos) | (curve_counters > 0)
+        x[:, i, 0] = np.where(seen, ordering + 1, 0)
+        x[:, i, 1] = x_flat[flat_idx]
+        x[:, i, 2:] = curve_configs[ordering]
+        y[:, i] = y_flat[flat_idx]
 
-        x.append(torch.cat([torch.stack([id_curve, epoch], dim=1), config], dim=1))
-        y.append(curve_val)
+    y_batch = torch.from_numpy(y).to(device)
 
-    x = torch.stack(x, dim=1).to(device).float()
-    y = torch.stack(y, dim=1).to(device).float()
+    return Batch(x=torch.from_numpy(x).to(device), y=y_batch, target_y=y_batch)
 
-    return Batch(x=x, y=y, target_y=y)
+
+EPOCH_STD = math.sqrt(1 / 12)
 
 
 class MultiCurvesEncoder(torch.nn.Module):
     def __init__(self, in_dim: int, out_dim: int) -> None:
         super().__init__()
         seq_len = 1000
-        self.normalizer = torch.nn.Sequential(
-            encoders.Normalize(0.5, math.sqrt(1 / 12)),
-        )
         self.epoch_enc = torch.nn.Linear(1, out_dim, bias=False)
         self.idcurve_enc = torch.nn.Embedding(seq_len + 1, out_dim)
         self.configuration_enc = encoders.get_variable_num_features_encoder(encoders.Linear)(
@@ -500,9 +613,11 @@ class MultiCurvesEncoder(torch.nn.Module):
         )
 
     def forward(self, *x, **kwargs) -> torch.Tensor:
-        x = torch.cat(x, dim=-1)
+        # the inputs usually come as a single tensor, which does not need a copy
+        x = x[0] if len(x) == 1 else torch.cat(x, dim=-1)
         out = (
-            self.epoch_enc(self.normalizer(x[..., 1:2]))
+            # normalize epochs in [0, 1] like U(0, 1) inputs, inline to avoid two module calls
+            self.epoch_enc((x[..., 1:2] - 0.5) / EPOCH_STD)
             + self.idcurve_enc(x[..., :1].int()).squeeze(2)
             + self.configuration_enc(x[..., 2:])
         )
@@ -520,7 +635,8 @@ def sample_curves(
     hyperparameters = np.random.uniform(size=(num_hyperparameters, hyperparameter_dimensions))
     dataset_prior.new_dataset()
     curve_sampler = dataset_prior.curves_for_configs(hyperparameters)
-    curves = np.array(
-        [curve_sampler(np.linspace(0, 1, curve_length), cid) for cid in range(num_hyperparameters)]
-    )
+    curves = curve_sampler(
+        np.tile(np.linspace(0, 1, curve_length), num_hyperparameters),
+        np.repeat(np.arange(num_hyperparameters), curve_length),
+    ).reshape(num_hyperparameters, curve_length)
     return hyperparameters, curves
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from collections.abc import Callable
 from collections.abc import Generator
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import inspect
 import math
@@ -49,7 +51,7 @@ def get_expon_sep_sampler(base: int, min_eval_pos: int, seq_len: int) -> Callabl
 
 
 class PriorDataLoader:
-    def _load_chunk(self, chunk_id: int) -> None:
+    def _read_chunk(self, chunk_id: int) -> list[tuple[int, Batch]]:
         if self.partition:
             partition_id = chunk_id // 1000
             chunk_file = os.path.join(
@@ -58,10 +60,35 @@ class PriorDataLoader:
         else:
             chunk_file = os.path.join(self.path, f"chunk_{chunk_id}.pkl")
         with open(chunk_file, "rb") as f:
-            self.loaded_chunk = cloudpickle.load(f)
+            chunk = cloudpickle.load(f)
+        if torch.cuda.is_available():
+            # page-lock the batches (in the background, when prefetched), so that their copies
+            # to the device can run asynchronously
+            for _, batch_data in chunk:
+                y = batch_data.y.pin_memory()
+                if batch_data.target_y is not batch_data.y:
+                    batch_data.target_y = batch_data.target_y.pin_memory()
+                else:
+                    batch_data.target_y = y
+                batch_data.x = batch_data.x.pin_memory()
+                batch_data.y = y
+        return chunk
+
+    def _load_chunk(self, chunk_id: int) -> None:
+        # use the chunk read in the background if it is the requested one
+        prefetched: tuple[int, Future] | None = getattr(self, "_prefetched", None)
+        if prefetched is not None and prefetched[0] == chunk_id:
+            self.loaded_chunk = prefetched[1].result()
+        else:
+            self.loaded_chunk = self._read_chunk(chunk_id)
         self.loaded_chunk_id = chunk_id
         self.batch_counter = 0
         self.subsample_counter = 0
+        # read the next chunk in the background, while this one is consumed
+        if not hasattr(self, "_prefetcher"):
+            self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        next_id = (chunk_id + 1) % self.n_chunks
+        self._prefetched = (next_id, self._prefetcher.submit(self._read_chunk, next_id))
 
     def __init__(
         self,
@@ -79,18 +106,18 @@ class PriorDataLoader:
             self.partition = os.path.isdir(os.path.join(self.path, "partition_0"))
         else:
             self.partition = partition
-        if not store:
-            self._load_chunk(0)
 
         self.n_chunks = n_chunks
         self.subsample = subsample
+        if not store:
+            self._load_chunk(0)
 
     def get_batch(self, device: torch.device | None) -> Batch:
         if self.subsample == 1:
             _, batch_data = self.loaded_chunk[self.batch_counter]
-            batch_data.x = batch_data.x.to(device)
-            batch_data.y = batch_data.y.to(device)
-            batch_data.target_y = batch_data.target_y.to(device)
+            batch_data.x = batch_data.x.to(device, non_blocking=True)
+            batch_data.y = batch_data.y.to(device, non_blocking=True)
+            batch_data.target_y = batch_data.target_y.to(device, non_blocking=True)
             self.batch_counter += 1
             if self.batch_counter >= len(self.loaded_chunk):
                 self._load_chunk((self.loaded_chunk_id + 1) % self.n_chunks)
@@ -102,17 +129,17 @@ class PriorDataLoader:
                 low = subsample_size * self.subsample_counter
                 high = subsample_size * (self.subsample_counter + 1)
                 batch_data = Batch(
-                    full_batch_data.x[:, low:high, :].to(device),
-                    full_batch_data.y[:, low:high].to(device),
-                    full_batch_data.target_y[:, low:high].to(device),
+                    full_batch_data.x[:, low:high, :].to(device, non_blocking=True),
+                    full_batch_data.y[:, low:high].to(device, non_blocking=True),
+                    full_batch_data.target_y[:, low:high].to(device, non_blocking=True),
                 )
                 self.subsample_counter += 1
             else:
                 low = subsample_size * self.subsample_counter
                 batch_data = Batch(
-                    full_batch_data.x[:, low:, :].to(device),
-                    full_batch_data.y[:, low:].to(device),
-                    full_batch_data.target_y[:, low:].to(device),
+                    full_batch_data.x[:, low:, :].to(device, non_blocking=True),
+                    full_batch_data.y[:, low:].to(device, non_blocking=True),
+                    full_batch_data.target_y[:, low:].to(device, non_blocking=True),
                 )
                 self.subsample_counter = 0
                 self.batch_counter += 1
@@ -297,9 +324,9 @@ class DistributedPriorDataLoader(PriorDataLoader):
 
         if self.subsample == 1:
             _, batch_data = self.loaded_chunk[self.batch_counter]
-            batch_data.x = batch_data.x.to(device)
-            batch_data.y = batch_data.y.to(device)
-            batch_data.target_y = batch_data.target_y.to(device)
+            batch_data.x = batch_data.x.to(device, non_blocking=True)
+            batch_data.y = batch_data.y.to(device, non_blocking=True)
+            batch_data.target_y = batch_data.target_y.to(device, non_blocking=True)
             self.batch_counter += 1
             if self.batch_counter >= len(self.loaded_chunk):
                 self._load_chunk((self.loaded_chunk_id + 1) % self.n_chunks)
@@ -311,17 +338,17 @@ class DistributedPriorDataLoader(PriorDataLoader):
                 low = subsample_size * self.subsample_counter
                 high = subsample_size * (self.subsample_counter + 1)
                 batch_data = Batch(
-                    full_batch_data.x[:, low:high, :].to(device),
-                    full_batch_data.y[:, low:high].to(device),
-                    full_batch_data.target_y[:, low:high].to(device),
+                    full_batch_data.x[:, low:high, :].to(device, non_blocking=True),
+                    full_batch_data.y[:, low:high].to(device, non_blocking=True),
+                    full_batch_data.target_y[:, low:high].to(device, non_blocking=True),
                 )
                 self.subsample_counter += 1
             else:
                 low = subsample_size * self.subsample_counter
                 batch_data = Batch(
-                    full_batch_data.x[:, low:, :].to(device),
-                    full_batch_data.y[:, low:].to(device),
-                    full_batch_data.target_y[:, low:].to(device),
+                    full_batch_data.x[:, low:, :].to(device, non_blocking=True),
+                    full_batch_data.y[:, low:].to(device, non_blocking=True),
+                    full_batch_data.target_y[:, low:].to(device, non_blocking=True),
                 )
                 self.subsample_counter = 0
                 self.batch_counter += 1